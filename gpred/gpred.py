@@ -19,8 +19,58 @@
 import argparse
 import sys
 import os
-import csv
+import heapq
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from bisect import bisect_left
+from itertools import product
 import re
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+
+    def njit(*args, **kwargs):
+        """Numba is optional: without it compiled functions run as Python."""
+        if args and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+# Upper case and replace uracile by thymine in one pass
+UPPER_DNA_TABLE = bytes.maketrans(b"abcdefghijklmnopqrstuvwxyzU",
+                                  b"ABCDEFGHIJKLMNOPQRSTTVWXYZT")
+WHITESPACES = b" \t\n\r\x0b\x0c"
+RC_TABLE = bytes.maketrans(b"ACGTNacgtn", b"TGCANtgcan")
+LINESEP = os.linesep.encode()
+# Fasta output is written by blocks of about this size
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Gene detection over genome involves to consider a thymine instead of
+# an uracile that we would find on the expressed RNA
+#start_codons = ['TTG', 'CTG', 'ATT', 'ATG', 'GTG']
+#stop_codons = ['TAA', 'TAG', 'TGA']
+START_REGEX = re.compile(b'AT[TG]|[ATCG]TG')
+STOP_REGEX = re.compile(b'TA[GA]|TGA')
+# Shine AGGAGGUAA
+#AGGA ou GGAGG
+SHINE_REGEX = re.compile(b'A?G?GAGG|GGAG|GG.GG')
+# Longest motif (AGGAGG), chunks are read that far past their end
+MOTIF_OVERLAP = 6
+# Same motifs read on the reverse strand, searched on the forward one
+START_RC_REGEX = re.compile(b'[AC]AT|CA[ACG]')
+STOP_RC_REGEX = re.compile(b'[CT]TA|TCA')
+SHINE_RC_REGEX = re.compile(b'(?<=(CCTCCT))|(?<=(CCTCT))|(?<=(CCTCC))'
+                            b'|(?<=(CCTC))|(?<=(CTCC))|(?<=(CC.CC))')
+# Binary search usable from predict_genes_core in both modes
+search_sorted = bisect_left if np is None else np.searchsorted
+# Codons are packed by find_codons with one code per base (N for others)
+CODON_BASES = b"ACGTN"
+if np is not None:
+    BASE_CODES = np.full(256, CODON_BASES.index(b"N"), dtype=np.uint8)
+    BASE_CODES[np.frombuffer(CODON_BASES, dtype=np.uint8)] = np.arange(len(CODON_BASES))
 
 
 def isfile(path):
@@ -78,19 +128,33 @@ def get_arguments():
 
 
 def read_fasta(fasta_file):
-    """Extract the complete genome sequence as a single string.
+    """Extract the complete genome sequence as a single bytes string.
     If several only one sequence is considered
+    The file is memory mapped: blocks of sequence lines are copied once,
+    while case, uracile and line returns are fixed in a single translate.
     """
-    sequence = ""
+    parts = []
     getone = False
-    with open(fasta_file, 'rt') as my_file:
-        for line in my_file:
-            if line.startswith(">"):
-                getone = True
-            else:
-                sequence += line.strip().upper()
+    with open(fasta_file, 'rb') as my_file:
+        # mmap cannot map an empty file
+        if os.fstat(my_file.fileno()).st_size == 0:
+            sys.exit("No sequence found")
+        with mmap.mmap(my_file.fileno(), 0, access=mmap.ACCESS_READ) as fasta:
+            size = len(fasta)
+            position = 0
+            while position < size:
+                if fasta[position] == ord(">"):
+                    getone = True
+                    end = fasta.find(b"\n", position)
+                    position = size if end == -1 else end + 1
+                else:
+                    end = fasta.find(b"\n>", position)
+                    end = size if end == -1 else end + 1
+                    parts.append(fasta[position:end].translate(UPPER_DNA_TABLE,
+                                                               WHITESPACES))
+                    position = end
     if getone:
-        return sequence
+        return b"".join(parts)
     sys.exit("No sequence found")
 
 
@@ -139,82 +203,324 @@ def has_shine_dalgarno(shine_regex, sequence,
     return False
 
 
-def predict_genes(sequence, start_regex, stop_regex, shine_regex,
-                  min_gene_len, max_shine_dalgarno_distance, min_gap):
-    """Predict most probable genes
-    Based on teacher's algorithml written in French
+def codon_table(codon_regex):
+    """Tell for each codon packed by find_codons whether it matches
+    codon_regex. N stands for any base other than A, C, G or T.
     """
-    #print(f"Studying a {len(sequence)} bases long sequence")
-    predicted_genes = []
+    table = np.zeros(len(CODON_BASES) ** 3, dtype=bool)
+    for index, codon in enumerate(product(CODON_BASES, repeat=3)):
+        table[index] = codon_regex.fullmatch(bytes(codon)) is not None
+    return table
 
+
+def find_codons(sequence, start_regex, stop_regex, pos, endpos):
+    """Find start and stop codons beginning between pos and endpos with
+    numpy: every codon is packed in one integer (one digit per base) and
+    looked up in codon_table. Codon regex must match exactly three bases.
+    Returns arrays of start and stop codon positions.
+    """
+    region = np.frombuffer(sequence, dtype=np.uint8)[pos:min(endpos + 2, len(sequence))]
+    codes = BASE_CODES[region]
+    nb_bases = len(CODON_BASES)
+    codons = (codes[:-2] * nb_bases + codes[1:-1]) * nb_bases + codes[2:]
+    starts = np.flatnonzero(codon_table(start_regex)[codons]) + pos
+    stops = np.flatnonzero(codon_table(stop_regex)[codons]) + pos
+    return starts, stops
+
+
+def find_motifs(sequence, start_regex, stop_regex, shine_regex,
+                pos=0, endpos=None):
+    """Find every start codon, stop codon and Shine-Dalgarno motif of the
+    sequence in a single pass.
+    The three regex are merged in one lookahead so that overlapping motifs
+    are all reported (they never begin at the same position). Returns the
+    sorted positions of start codons, the sorted positions of stop codons
+    for each reading frame, and the start and end positions of
+    Shine-Dalgarno motifs.
+    With numpy, codons are found by find_codons and only Shine-Dalgarno
+    motifs are left to the regex.
+    Only motifs beginning between pos and endpos are reported, so that a
+    genome can be scanned by chunks.
+    """
+    sequence_len = len(sequence)
+    if endpos is None:
+        endpos = sequence_len
+    if np is None:
+        motif_regex = re.compile(b"(?=(?P<start>%b)|(?P<stop>%b)|(?P<shine>%b))"
+                                 % (start_regex.pattern, stop_regex.pattern,
+                                    shine_regex.pattern))
+        starts = []
+        stops = [[], [], []]
+    else:
+        motif_regex = re.compile(b"(?=(?P<shine>%b))" % shine_regex.pattern)
+        start_array, stop_array = find_codons(sequence, start_regex,
+                                              stop_regex, pos, endpos)
+        starts = start_array.tolist()
+        stops = [stop_array[stop_array % 3 == frame].tolist()
+                 for frame in range(3)]
+    shine_starts = []
+    shine_ends = []
+    # Methods bound once, this loop runs for every motif of the genome
+    add_start = starts.append
+    add_stop = [frame_stops.append for frame_stops in stops]
+    add_shine_start = shine_starts.append
+    add_shine_end = shine_ends.append
+    scan_end = min(endpos + MOTIF_OVERLAP, sequence_len)
+    for match in motif_regex.finditer(sequence, pos, scan_end):
+        position = match.start()
+        if position >= endpos:
+            break
+        kind = match.lastgroup
+        if kind == "start":
+            add_start(position)
+        elif kind == "stop":
+            add_stop[position % 3](position)
+        else:
+            add_shine_start(position)
+            add_shine_end(match.end(kind))
+    return starts, stops, shine_starts, shine_ends
+
+
+def find_motifs_reverse(sequence, start_rc_regex, stop_rc_regex,
+                        shine_rc_regex, pos=0, endpos=None):
+    """Find motifs of the reverse complement strand by scanning the
+    sequence itself.
+    start_rc_regex and stop_rc_regex match the reverse complement of the
+    codons. shine_rc_regex is an alternation of lookbehinds matching the
+    reverse complement of each Shine-Dalgarno motif, ordered as the forward
+    regex would prefer them.
+    Returns the same values as find_motifs over reverse_complement(sequence).
+    pos and endpos bound the scanned region of the given (forward) sequence.
+    """
+    sequence_len = len(sequence)
+    if endpos is None:
+        endpos = sequence_len
+    last_codon = sequence_len - 3
+    if np is None:
+        codon_regex = re.compile(b"(?=(?P<start>%b)|(?P<stop>%b))"
+                                 % (start_rc_regex.pattern, stop_rc_regex.pattern))
+        starts = []
+        stops = [[], [], []]
+        # Methods bound once, this loop runs for every codon of the genome
+        add_start = starts.append
+        add_stop = [frame_stops.append for frame_stops in stops]
+        scan_end = min(endpos + MOTIF_OVERLAP, sequence_len)
+        for match in codon_regex.finditer(sequence, pos, scan_end):
+            forward_position = match.start()
+            if forward_position >= endpos:
+                break
+            position = last_codon - forward_position
+            if match.lastgroup == "start":
+                add_start(position)
+            else:
+                add_stop[position % 3](position)
+    else:
+        start_array, stop_array = find_codons(sequence, start_rc_regex,
+                                              stop_rc_regex, pos, endpos)
+        starts = (last_codon - start_array).tolist()
+        stop_array = last_codon - stop_array
+        stops = [stop_array[stop_array % 3 == frame].tolist()
+                 for frame in range(3)]
+    shine_starts = []
+    shine_ends = []
+    add_shine_start = shine_starts.append
+    add_shine_end = shine_ends.append
+    # Lookbehinds match at the end of the motif, the sequence end included
+    last_end = endpos if endpos < sequence_len else sequence_len + 1
+    for match in shine_rc_regex.finditer(sequence, pos, endpos):
+        forward_end = match.start()
+        if forward_end >= last_end:
+            break
+        position = sequence_len - forward_end
+        add_shine_start(position)
+        add_shine_end(position + match.end(match.lastindex)
+                      - match.start(match.lastindex))
+    # Scanning forward gives reverse strand positions in decreasing order
+    starts.reverse()
+    for frame_stops in stops:
+        frame_stops.reverse()
+    shine_starts.reverse()
+    shine_ends.reverse()
+    return starts, stops, shine_starts, shine_ends
+
+
+def merge_motifs(chunk_motifs):
+    """Concatenate motifs found over consecutive chunks of a strand.
+    Chunks must be given in increasing position order of that strand.
+    """
+    starts = []
+    stops = [[], [], []]
+    shine_starts = []
+    shine_ends = []
+    for chunk_starts, chunk_stops, chunk_shine_starts, chunk_shine_ends in chunk_motifs:
+        starts.extend(chunk_starts)
+        for frame_stops, chunk_frame_stops in zip(stops, chunk_stops):
+            frame_stops.extend(chunk_frame_stops)
+        shine_starts.extend(chunk_shine_starts)
+        shine_ends.extend(chunk_shine_ends)
+    return starts, stops, shine_starts, shine_ends
+
+
+@njit(cache=True)
+def predict_genes_core(starts, stops_0, stops_1, stops_2,
+                       shine_starts, shine_ends, sequence_len,
+                       min_gene_len, max_shine_dalgarno_distance, min_gap):
+    """Gene picking loop of predict_genes working on motif positions only.
+    Compiled with numba when available.
+    Returns a flat list alternating gene start and stop (1-based).
+    """
+    predicted_genes = []
+    nb_starts = len(starts)
+    nb_shines = len(shine_starts)
     start = 0
-    while len(sequence) - start >= min_gap:
-        start = find_start(start_regex, sequence, start, len(sequence))
-        #print(f"starting position {start}")
-        if start is None:
+    while sequence_len - start >= min_gap:
+        index = search_sorted(starts, start)
+        if index == nb_starts:
             break
-        stop = find_stop(stop_regex, sequence, start)
-        #print(f"found stop position {stop}")
-        if stop is None:
+        start = starts[index]
+        frame = start % 3
+        if frame == 0:
+            frame_stops = stops_0
+        elif frame == 1:
+            frame_stops = stops_1
+        else:
+            frame_stops = stops_2
+        index = search_sorted(frame_stops, start)
+        if index == len(frame_stops):
             start += 1
             continue
-        #print(f"current length {stop - start + 1} vs {min_gene_len}")
+        stop = frame_stops[index]
         if stop - start + 1 <= min_gene_len:
             # I would seek another stop but teacher's algo drop this start
             start += 1
             continue
-        #sd_present = has_shine_dalgarno(shine_regex, sequence, start, max_shine_dalgarno_distance)
-        #print(f"detected sd sequence: {sd_present}")
-        if not has_shine_dalgarno(shine_regex, sequence, start, max_shine_dalgarno_distance):
+        # Same as has_shine_dalgarno: first motif of the window must end
+        # at least 6 bases before the start codon
+        index = search_sorted(shine_starts, max(start - max_shine_dalgarno_distance, 0))
+        if index == nb_shines or start - shine_ends[index] <= 6:
             start += 1
             continue
         last_base = stop + 2 + 1  # +2 is 3rd codon letter, +1 for 1-based count
-        predicted_genes.append([start+1, last_base])
-        #print(f"saved gene positions {predicted_genes[-1]}")
+        predicted_genes.append(start + 1)
+        predicted_genes.append(last_base)
         start = last_base + min_gap
-        #print(f"start for next iteration: {start}")
     return predicted_genes
 
 
+def as_positions(positions):
+    """Convert a list of positions to the array type numba expects."""
+    if np is None:
+        return positions
+    return np.array(positions, dtype=np.int64)
+
+
+def pick_genes(motifs, sequence_len, min_gene_len,
+               max_shine_dalgarno_distance, min_gap):
+    """Select genes among motifs given by find_motifs or
+    find_motifs_reverse.
+    """
+    starts, stops, shine_starts, shine_ends = motifs
+    genes = predict_genes_core(
+        as_positions(starts), as_positions(stops[0]), as_positions(stops[1]),
+        as_positions(stops[2]), as_positions(shine_starts),
+        as_positions(shine_ends), sequence_len,
+        min_gene_len, max_shine_dalgarno_distance, min_gap)
+    return [[genes[i], genes[i + 1]] for i in range(0, len(genes), 2)]
+
+
+def predict_genes(sequence, start_regex, stop_regex, shine_regex,
+                  min_gene_len, max_shine_dalgarno_distance, min_gap):
+    """Predict most probable genes
+    Based on teacher's algorithml written in French
+    """
+    motifs = find_motifs(sequence, start_regex, stop_regex, shine_regex)
+    return pick_genes(motifs, len(sequence), min_gene_len,
+                      max_shine_dalgarno_distance, min_gap)
+
+
+def predict_genes_reverse(sequence, start_rc_regex, stop_rc_regex,
+                          shine_rc_regex, min_gene_len,
+                          max_shine_dalgarno_distance, min_gap):
+    """Predict most probable genes of the reverse complement strand
+    without building it.
+    Same result as predict_genes over reverse_complement(sequence).
+    """
+    motifs = find_motifs_reverse(sequence, start_rc_regex, stop_rc_regex,
+                                 shine_rc_regex)
+    return pick_genes(motifs, len(sequence), min_gene_len,
+                      max_shine_dalgarno_distance, min_gap)
+
+
 def write_genes_pos(predicted_genes_file, probable_genes):
     """Write list of gene positions
     """
     try:
-        with open(predicted_genes_file, "wt") as my_file_out:
-            predict_genes_writer = csv.writer(my_file_out, delimiter=",")
-            predict_genes_writer.writerow(["Start", "Stop"])
-            predict_genes_writer.writerows(probable_genes)
+        with open(predicted_genes_file, "wt", newline="") as my_file_out:
+            my_file_out.write("Start,Stop\r\n")
+            my_file_out.write("".join(f"{start},{stop}\r\n"
+                                      for start, stop in probable_genes))
     except IOError:
         sys.exit("Error cannot open {}".format(predicted_genes_file))
 
 
-def fill(text, width=80):
-    """Split text with a line return to respect fasta format"""
-    return os.linesep.join(text[i:i+width] for i in range(0, len(text), width))
+def write_fasta_record(fasta, buffer, name, sequence, width=80):
+    """Append a fasta record with lines of at most width bases to buffer.
+    buffer is written to fasta and emptied once it holds WRITE_BUFFER_SIZE
+    bytes.
+    """
+    buffer += b">" + name + LINESEP
+    view = memoryview(sequence)
+    for i in range(0, len(view), width):
+        buffer += view[i:i+width]
+        buffer += LINESEP
+    if len(buffer) >= WRITE_BUFFER_SIZE:
+        fasta.write(buffer)
+        buffer.clear()
 
 
-def write_genes(fasta_file, sequence, probable_genes, sequence_rc, probable_genes_comp):
+def write_genes(fasta_file, sequence, probable_genes, probable_genes_comp):
     """Write gene sequence in fasta format
+    Genes of probable_genes_comp are positioned on the reverse complement
+    strand: only their own sequence is reverse complemented.
     """
+    buffer = bytearray()
     try:
-        with open(fasta_file, "wt") as fasta:
+        with open(fasta_file, "wb") as fasta:
             for i,gene_pos in enumerate(probable_genes):
-                fasta.write(">gene_{0}{1}{2}{1}".format(
-                    i+1, os.linesep,
-                    fill(sequence[gene_pos[0]-1:gene_pos[1]])))
-            i = i+1
+                write_fasta_record(fasta, buffer, b"gene_%d" % (i+1),
+                                   sequence[gene_pos[0]-1:gene_pos[1]])
+            i = len(probable_genes)
             for j,gene_pos in enumerate(probable_genes_comp):
-                fasta.write(">gene_{0}{1}{2}{1}".format(
-                            i+1+j, os.linesep,
-                            fill(sequence_rc[gene_pos[0]-1:gene_pos[1]])))
+                write_fasta_record(fasta, buffer, b"gene_%d" % (i+1+j), reverse_complement(
+                    sequence[len(sequence)-gene_pos[1]:len(sequence)-gene_pos[0]+1]))
+            fasta.write(buffer)
     except IOError:
         sys.exit("Error cannot open {}".format(fasta_file))
 
 
 def reverse_complement(kmer):
     """Get the reverse complement"""
-    complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
-    return ''.join([complement[base] for base in kmer[::-1]])
+    return kmer.translate(RC_TABLE)[::-1]
+
+
+def scan_chunk(reverse, shared_name, sequence_len, pos, endpos):
+    """Find motifs of one strand between pos and endpos of a genome stored
+    in shared memory.
+    Used by main to scan the genome by chunks in worker processes.
+    """
+    shared = shared_memory.SharedMemory(name=shared_name)
+    try:
+        sequence = shared.buf[:sequence_len]
+        if reverse:
+            motifs = find_motifs_reverse(sequence, START_RC_REGEX, STOP_RC_REGEX,
+                                         SHINE_RC_REGEX, pos, endpos)
+        else:
+            motifs = find_motifs(sequence, START_REGEX, STOP_REGEX, SHINE_REGEX,
+                                 pos, endpos)
+        sequence.release()
+    finally:
+        shared.close()
+    return motifs
 
 
 #==============================================================
@@ -225,59 +531,57 @@ def main():
     Main program function
     """
 
-    def call_me_predict_genes(sequence):
-        """Wrap predict_genes function with given main arguments.
-        """
-        min_length = args.min_gene_len
-        max_sd_dist = args.max_shine_dalgarno_distance
-        min_spacing = args.min_gap
-
-        return predict_genes(sequence, start_regex, stop_regex, shine_regex,
-                             min_length, max_sd_dist, min_spacing)
-
-    # Gene detection over genome involves to consider a thymine instead of
-    # an uracile that we would find on the expressed RNA
-    #start_codons = ['TTG', 'CTG', 'ATT', 'ATG', 'GTG']
-    #stop_codons = ['TAA', 'TAG', 'TGA']
-    start_regex = re.compile('AT[TG]|[ATCG]TG')
-    stop_regex = re.compile('TA[GA]|TGA')
-    # Shine AGGAGGUAA
-    #AGGA ou GGAGG
-    shine_regex = re.compile('A?G?GAGG|GGAG|GG.{1}GG')
     # Arguments
     args = get_arguments()
 
     # Retrieve sequence
     sequence = read_fasta(args.genome_file)
     print(f"Input sequence length: {len(sequence)}")
-    sequence.replace("U", "T")
 
-    # Let us do magic in 5' to 3'
-    print("Scanning forward sequence...")
-    forward_genes = call_me_predict_genes(sequence)
-    print("done")
-
-    # Let's do the same in 3' to 5'
-    print("Reverse complement generation")
-    sequence_rc = reverse_complement(sequence)
-    print("Scannning reverse sequence...")
-    reverse_genes = call_me_predict_genes(sequence_rc)
+    # Let us do magic in 5' to 3' and 3' to 5' at the same time: both
+    # strands are scanned by chunks in worker processes reading the genome
+    # from shared memory, genes are then picked from the merged motifs
+    print("Scanning forward and reverse sequences...")
+    nb_workers = os.cpu_count() or 1
+    chunk_len = -(-len(sequence) // nb_workers)
+    bounds = [(pos, min(pos + chunk_len, len(sequence)))
+              for pos in range(0, len(sequence), max(chunk_len, 1))]
+    shared = shared_memory.SharedMemory(create=True, size=max(len(sequence), 1))
+    try:
+        shared.buf[:len(sequence)] = sequence
+        with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+            forward_futures = [executor.submit(scan_chunk, False, shared.name,
+                                               len(sequence), pos, endpos)
+                               for pos, endpos in bounds]
+            reverse_futures = [executor.submit(scan_chunk, True, shared.name,
+                                               len(sequence), pos, endpos)
+                               for pos, endpos in bounds]
+            forward_motifs = merge_motifs(
+                future.result() for future in forward_futures)
+            # Last chunk of the sequence holds the first reverse positions
+            reverse_motifs = merge_motifs(
+                future.result() for future in reversed(reverse_futures))
+    finally:
+        shared.close()
+        shared.unlink()
+    forward_genes = pick_genes(forward_motifs, len(sequence), args.min_gene_len,
+                               args.max_shine_dalgarno_distance, args.min_gap)
+    reverse_genes = pick_genes(reverse_motifs, len(sequence), args.min_gene_len,
+                               args.max_shine_dalgarno_distance, args.min_gap)
     print("done")
 
     # Update reverse positions in 5'-3' values and merge them with forward positions
     print("Building final gene list")
-    probable_genes = forward_genes[:]
-    for end, start in reverse_genes[::-1]:
-        end = len(sequence) - end
-        start = len(sequence) - start
-        probable_genes.append([start, end])
+    # Both lists are already sorted: reverse genes come last to first
+    reverse_positions = ([len(sequence) - start, len(sequence) - end]
+                         for end, start in reversed(reverse_genes))
+    probable_genes = list(heapq.merge(forward_genes, reverse_positions))
     print(f"{len(probable_genes):10d} probable genes found")
-    probable_genes.sort()
 
     # Call to output functions
     print("Writting output files")
     write_genes_pos(args.predicted_genes_file, probable_genes)
-    write_genes(args.fasta_file, sequence, forward_genes, sequence_rc, reverse_genes)
+    write_genes(args.fasta_file, sequence, forward_genes, reverse_genes)
 
 
 if __name__ == '__main__':
@@ -9,13 +9,13 @@ from gpred import *
 
 def test_read_fasta():
     sequence = read_fasta(os.path.abspath(os.path.join(os.path.dirname(__file__), "genome.fasta")))
-    assert(sequence == "AGCTTTTCATTCTGACTGCAACGGGCAATATGTCTCTGTGTGGATTAAAAAAAGAGTGTCTGATAGCAGCTTCTGAACTGGTTACCTGCCGTGAGTAAATTAAAATTTTATTGACTTAGGTCACTAAATACTTTAACCAATATAGGCATAGCGCACAGACAGATAAAAATTACAGAGTACACAACATCCATGAAACGCATTAGCACCACCATTACCACCACCATCACCATTACCACAGGTAACGGTGCGGGCTGACGCGTACAGGAAACACAGAAAAAAGCCCGCACCTGACAGTGCGGGCTTTTTTTTTCGACCAAAGGTAACGAGGTAACAACCATGCGAGTGTTGAAGTTCGGCGGTACATCAGTGGCAAATGCAGAACGTTTTCTGCGTGTTGCCGAGGAGGTAACTCAAACCATGAAACGCATTAGCACCACCATTACCACCACCATCACCATTACCACAGGTAACGGTGCGGGCTGA")
+    assert(sequence == b"AGCTTTTCATTCTGACTGCAACGGGCAATATGTCTCTGTGTGGATTAAAAAAAGAGTGTCTGATAGCAGCTTCTGAACTGGTTACCTGCCGTGAGTAAATTAAAATTTTATTGACTTAGGTCACTAAATACTTTAACCAATATAGGCATAGCGCACAGACAGATAAAAATTACAGAGTACACAACATCCATGAAACGCATTAGCACCACCATTACCACCACCATCACCATTACCACAGGTAACGGTGCGGGCTGACGCGTACAGGAAACACAGAAAAAAGCCCGCACCTGACAGTGCGGGCTTTTTTTTTCGACCAAAGGTAACGAGGTAACAACCATGCGAGTGTTGAAGTTCGGCGGTACATCAGTGGCAAATGCAGAACGTTTTCTGCGTGTTGCCGAGGAGGTAACTCAAACCATGAAACGCATTAGCACCACCATTACCACCACCATCACCATTACCACAGGTAACGGTGCGGGCTGA")
 
 
 def test_find_start():
-    start_regex = re.compile('AT[TG]|[ATCG]TG')
-    seq_with_start = "AACGGCGTGAAACC"
-    seq_without_start = "AAAAAAAAAAACCCCCCCCCCC"
+    start_regex = re.compile(b'AT[TG]|[ATCG]TG')
+    seq_with_start = b"AACGGCGTGAAACC"
+    seq_without_start = b"AAAAAAAAAAACCCCCCCCCCC"
     res_start = find_start(start_regex, seq_with_start, 0, len(seq_with_start))
     res_no_start = find_start(start_regex, seq_without_start, 0, len(seq_without_start))
     assert(res_start == 6)
@@ -23,8 +23,8 @@ def test_find_start():
 
 
 def test_find_stop():
-    stop_regex = re.compile('TA[GA]|TGA')
-    seq_with_stop = "ATGAAACGCATTAGCACCACCATTACCACCACCATCACCATTACCACAGGTAACGGTGCGGGCTGA"
+    stop_regex = re.compile(b'TA[GA]|TGA')
+    seq_with_stop = b"ATGAAACGCATTAGCACCACCATTACCACCACCATCACCATTACCACAGGTAACGGTGCGGGCTGA"
     seq_without_stop = seq_with_stop[:-3]
     res_stop = find_stop(stop_regex, seq_with_stop, 3)
     res_no_stop = find_stop(stop_regex, seq_without_stop, 3)
@@ -33,11 +33,11 @@ def test_find_stop():
 
 
 def test_has_shine_dalgarno():
-    shine_regex = re.compile('A?G?GAGG|GGAG|GG.{1}GG')
-    seq_without_sd = "ATGAAACGCATTAGCACCACCATTACCACCACCATCACCATTACCACAGGTAACGGTGCGGGCTGA"
-    seq_with_sd = "AGGAGGTAACTCAAACC" + seq_without_sd
-    seq_with_sd_too_close = "AGGAGGTAACTC" + seq_without_sd
-    seq_with_sd_too_far = "AGGAGGTAACTCAAACCGG" + seq_without_sd
+    shine_regex = re.compile(b'A?G?GAGG|GGAG|GG.{1}GG')
+    seq_without_sd = b"ATGAAACGCATTAGCACCACCATTACCACCACCATCACCATTACCACAGGTAACGGTGCGGGCTGA"
+    seq_with_sd = b"AGGAGGTAACTCAAACC" + seq_without_sd
+    seq_with_sd_too_close = b"AGGAGGTAACTC" + seq_without_sd
+    seq_with_sd_too_far = b"AGGAGGTAACTCAAACCGG" + seq_without_sd
     res_sd = has_shine_dalgarno(shine_regex, seq_with_sd, 17, 16)
     res_no_sd = has_shine_dalgarno(shine_regex, seq_without_sd, 15, 16)
     res_sd_too_close = has_shine_dalgarno(shine_regex, seq_with_sd_too_close, 12, 16)
@@ -50,12 +50,68 @@ def test_has_shine_dalgarno():
 
 def test_predict_genes():
     sequence = read_fasta(os.path.abspath(os.path.join(os.path.dirname(__file__), "genome.fasta")))
-    start_regex = re.compile('AT[TG]|[ATCG]TG')
-    stop_regex = re.compile('TA[GA]|TGA')
-    shine_regex = re.compile('A?G?GAGG|GGAG|GG.{1}GG')
+    start_regex = re.compile(b'AT[TG]|[ATCG]TG')
+    stop_regex = re.compile(b'TA[GA]|TGA')
+    shine_regex = re.compile(b'A?G?GAGG|GGAG|GG.{1}GG')
     res = predict_genes(sequence, start_regex, stop_regex, shine_regex, 50, 16, 40)
     assert(len(res) == 1)
     assert(res[0][0] == 337)
     assert(res[0][1] == 483)
     res_neg = predict_genes(sequence[0:400], start_regex, stop_regex, shine_regex, 50, 16, 40)
     assert(len(res_neg) == 0)
+
+
+def test_find_motifs():
+    start_regex = re.compile(b'AT[TG]|[ATCG]TG')
+    stop_regex = re.compile(b'TA[GA]|TGA')
+    shine_regex = re.compile(b'A?G?GAGG|GGAG|GG.{1}GG')
+    res = find_motifs(b"CATTGAAATGTAAGGAGGC", start_regex, stop_regex, shine_regex)
+    starts, stops, shine_starts, shine_ends = res
+    assert(starts == [1, 2, 7])
+    assert(stops == [[3], [10], []])
+    assert(shine_starts == [12, 13, 14])
+    assert(shine_ends == [18, 18, 18])
+
+
+def test_predict_genes_reverse():
+    sequence = read_fasta(os.path.abspath(os.path.join(os.path.dirname(__file__), "genome.fasta")))
+    sequence_rc = reverse_complement(sequence)
+    for seq in (sequence, sequence_rc):
+        res = predict_genes_reverse(seq, START_RC_REGEX, STOP_RC_REGEX,
+                                    SHINE_RC_REGEX, 10, 16, 0)
+        res_rc = predict_genes(reverse_complement(seq), START_REGEX, STOP_REGEX,
+                               SHINE_REGEX, 10, 16, 0)
+        assert(res == res_rc)
+    res_motifs = find_motifs_reverse(sequence, START_RC_REGEX, STOP_RC_REGEX, SHINE_RC_REGEX)
+    assert(res_motifs == find_motifs(sequence_rc, START_REGEX, STOP_REGEX, SHINE_REGEX))
+
+
+def test_reverse_complement():
+    assert(reverse_complement(b"AACGTN") == b"NACGTT")
+    assert(reverse_complement(b"atgc") == b"gcat")
+    assert(reverse_complement(b"") == b"")
+
+
+def test_find_motifs_by_chunks():
+    sequence = read_fasta(os.path.abspath(os.path.join(os.path.dirname(__file__), "genome.fasta")))
+    bounds = [(pos, min(pos + 7, len(sequence))) for pos in range(0, len(sequence), 7)]
+    res = merge_motifs(find_motifs(sequence, START_REGEX, STOP_REGEX, SHINE_REGEX, pos, endpos)
+                       for pos, endpos in bounds)
+    assert(res == find_motifs(sequence, START_REGEX, STOP_REGEX, SHINE_REGEX))
+    res_rc = merge_motifs(find_motifs_reverse(sequence, START_RC_REGEX, STOP_RC_REGEX,
+                                              SHINE_RC_REGEX, pos, endpos)
+                          for pos, endpos in reversed(bounds))
+    assert(res_rc == find_motifs_reverse(sequence, START_RC_REGEX, STOP_RC_REGEX,
+                                         SHINE_RC_REGEX))
+
+
+def test_find_codons():
+    pytest.importorskip("numpy")
+    if np is None:
+        pytest.skip("numba is not installed")
+    starts, stops = find_codons(b"CATTGAAATGTAANATG", START_REGEX, STOP_REGEX, 0, 17)
+    assert(starts.tolist() == [1, 2, 7, 14])
+    assert(stops.tolist() == [3, 10])
+    starts, stops = find_codons(b"CATTGAAATGTAANATG", START_REGEX, STOP_REGEX, 2, 10)
+    assert(starts.tolist() == [2, 7])
+    assert(stops.tolist() == [3])